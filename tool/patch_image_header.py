@@ -1,45 +1,167 @@
 #!/usr/bin/env python3
 import argparse
 import binascii
+import functools
 import struct
 import hashlib
+import mmap
 import os
-from ecdsa import SigningKey
-from ecdsa.util import sigencode_string
 
-def generate_signature_for_data(data, private_key_file):
+@functools.lru_cache(maxsize=4)
+def _load_signing_key(private_key_file, mtime):
     """
-    Generate ECC signature for data using private key
+    Load and parse the PEM private key, cached per (path, mtime)
+    Returns a coincurve.PrivateKey for secp256k1 keys when coincurve is available,
+    else an ecdsa SigningKey
+    """
+    with open(private_key_file, "rb") as f:
+        key_pem = f.read()
+
+    # Optional: libsecp256k1 (via coincurve) is much faster than python-ecdsa.
+    # cryptography is used to extract the raw scalar from the SEC1 PEM key.
+    # Signing libraries are imported here so that --info and unsigned
+    # --add-header runs don't pay for loading them.
+    try:
+        import coincurve
+        from cryptography.exceptions import UnsupportedAlgorithm
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+    except ImportError:
+        coincurve = None
+
+    if coincurve is not None:
+        try:
+            private_key = serialization.load_pem_private_key(key_pem, password=None)
+            # libsecp256k1 only handles secp256k1; keys on other curves go
+            # through python-ecdsa, which uses the curve named in the PEM
+            if isinstance(private_key, ec.EllipticCurvePrivateKey) and isinstance(private_key.curve, ec.SECP256K1):
+                # Extract the 32-byte private scalar for libsecp256k1
+                raw_key = private_key.private_numbers().private_value.to_bytes(32, "big")
+                return coincurve.PrivateKey(raw_key)
+        except (ValueError, TypeError, UnsupportedAlgorithm):
+            # Keys cryptography can't parse (e.g. explicit curve parameters)
+            # may still be loadable by python-ecdsa
+            pass
+
+    from ecdsa import SigningKey
+    return SigningKey.from_pem(key_pem)
+
+
+def _hash_fileobj(f):
+    """
+    Compute the SHA256 digest of an open binary file from its current position to EOF
+    Reads in 1 MiB chunks so the payload is never held in memory at once
+    """
+    h = hashlib.sha256()
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+        h.update(chunk)
+    return h.digest()
+
+
+def _hash_file(path, start=0):
+    """
+    Compute the SHA256 digest of a file from offset start to EOF
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        return _hash_fileobj(f)
+
+
+def _copy_payload(src, dst, count):
+    """
+    Copy count bytes from the start of src to the current end of dst
+    Uses os.sendfile() so the data stays in the kernel, falling back to a
+    buffered copy where file-to-file sendfile is not supported
+    """
+    dst.flush()
+    offset = 0
+    try:
+        while offset < count:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, count - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError):
+        pass
+
+    if offset < count:
+        # Imported here since this fallback is rarely needed
+        import shutil
+
+        src.seek(offset)
+        dst.seek(0, os.SEEK_END)
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+
+def generate_signature_for_digest(digest, private_key_file):
+    """
+    Generate ECC signature for a precomputed SHA256 digest using private key
     Returns 64-byte signature or None if signing fails
     """
-    if not os.path.exists(private_key_file):
-        print(f"Error: Private key file '{private_key_file}' not found")
-        return None
-    
     try:
-        # Read private key
-        with open(private_key_file, "rb") as f:
-            key_pem = f.read()
-        
-        # Create signing key from private key
-        key = SigningKey.from_pem(key_pem)
-        
-        # Generate signature using SHA256 hash and string encoding
-        signature = key.sign_deterministic(data, hashfunc=hashlib.sha256, sigencode=sigencode_string)
+        key = _load_signing_key(private_key_file, os.path.getmtime(private_key_file))
+
+        if hasattr(key, "sign_recoverable"):
+            # coincurve: RFC6979 nonce over the given digest; drop the recovery id to get r||s
+            signature = key.sign_recoverable(digest, hasher=None)[:64]
+        else:
+            from ecdsa.util import sigencode_string
+
+            # Sign the digest directly (no rehash) using string encoding
+            signature = key.sign_digest_deterministic(digest, hashfunc=hashlib.sha256, sigencode=sigencode_string)
         
-        # Ensure signature is exactly 64 bytes (pad or truncate if necessary)
-        if len(signature) < 64:
-            signature = signature + b'\x00' * (64 - len(signature))
-        elif len(signature) > 64:
-            signature = signature[:64]
-            
+        # r||s for a 256-bit curve; other curves don't fit the header field
+        if len(signature) != 64:
+            raise ValueError(f"unexpected signature length {len(signature)}, expected 64")
+
         return signature
         
+    except FileNotFoundError:
+        print(f"Error: Private key file '{private_key_file}' not found")
+        return None
     except Exception as e:
         print(f"Error generating signature: {e}")
         return None
 
 
+def generate_signature_for_data(data, private_key_file):
+    """
+    Generate ECC signature for data using private key
+    Returns 64-byte signature or None if signing fails
+    """
+    return generate_signature_for_digest(hashlib.sha256(data).digest(), private_key_file)
+
+
+def _hash_file_or_none(path, start=0):
+    """
+    _hash_file() for sign_many() workers
+    Returns None (after reporting the error) if the file can't be read
+    """
+    try:
+        return _hash_file(path, start)
+    except OSError as e:
+        print(f"Error reading '{path}': {e}")
+        return None
+
+
+def sign_many(paths, private_key_file, start=0):
+    """
+    Generate ECC signatures for several files with one private key
+    Files are hashed in parallel worker processes (from offset start to EOF),
+    then the digests are signed serially with the cached key
+    Returns a list of 64-byte signatures (None where signing fails), in input order
+    """
+    # Imported here so single-image runs don't pay for it
+    import concurrent.futures
+
+    paths = list(paths)
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        digests = list(executor.map(_hash_file_or_none, paths, [start] * len(paths)))
+
+    return [generate_signature_for_digest(digest, private_key_file) if digest is not None else None
+            for digest in digests]
+
+
 def patch_binary_payload(bin_filename, private_key_file=None, sign_only=False, entrypoint=None):
     """
     Patch image_size field, entrypoint, and optionally generate signature for image_hdr_t in place in binary
@@ -56,67 +178,81 @@ def patch_binary_payload(bin_filename, private_key_file=None, sign_only=False, e
     IMAGE_HDR_MAGIC = 0x9ca3
     IMAGE_HDR_VERSION = 1
 
-    with open(bin_filename, "rb") as f:
-        image_hdr = f.read(IMAGE_HDR_SIZE_BYTES)
-        data = f.read()
+    with open(bin_filename, "r+b") as f:
+        # Check the size first: mmap refuses to map an empty file
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size < IMAGE_HDR_SIZE_BYTES:
+            raise Exception(
+                "Binary too small. Expected at least {} bytes Got {}".format(
+                    IMAGE_HDR_SIZE_BYTES, file_size
+                )
+            )
 
-    image_magic, image_hdr_version = struct.unpack("<HH", image_hdr[0:4])
+        # Map the image so the payload can be hashed and the header patched in
+        # place without copying the file into Python memory
+        with mmap.mmap(f.fileno(), 0) as mm:
+            image_magic, image_hdr_version = struct.unpack_from("<HH", mm, 0)
 
-    if image_magic != IMAGE_HDR_MAGIC:
-        raise Exception(
-            "Unsupported Binary Type. Expected 0x{:02x} Got 0x{:02x}".format(
-                IMAGE_HDR_MAGIC, image_magic
-            )
-        )
+            if image_magic != IMAGE_HDR_MAGIC:
+                raise Exception(
+                    "Unsupported Binary Type. Expected 0x{:02x} Got 0x{:02x}".format(
+                        IMAGE_HDR_MAGIC, image_magic
+                    )
+                )
 
-    if image_hdr_version != IMAGE_HDR_VERSION:
-        raise Exception(
-            "Unsupported Image Header Version. Expected 0x{:02x} Got 0x{:02x}".format(
-                IMAGE_HDR_VERSION, image_hdr_version
-            )
-        )
+            if image_hdr_version != IMAGE_HDR_VERSION:
+                raise Exception(
+                    "Unsupported Image Header Version. Expected 0x{:02x} Got 0x{:02x}".format(
+                        IMAGE_HDR_VERSION, image_hdr_version
+                    )
+                )
 
-    data_size = len(data)
-    
-    # Generate signature for the image data if private key is provided
-    signature = None
-    if private_key_file:
-        print(f"Generating signature using private key: {private_key_file}")
-        signature = generate_signature_for_data(data, private_key_file)
-        if signature:
-            print(f"Signature generated successfully (64 bytes)")
-        else:
-            print("Warning: Failed to generate signature, signature field will remain unchanged")
+            data_size = len(mm) - IMAGE_HDR_SIZE_BYTES
 
-    # Prepare updates
-    image_hdr_data_size = struct.pack("<L", data_size)
-    
-    print(f"Patching binary '{bin_filename}':")
-    print(f"  Data size: {data_size} bytes")
-    if entrypoint is not None:
-        print(f"  Entry point: 0x{entrypoint:016x}")
-    if signature:
-        print(f"  Signature: {signature[:8].hex()}... (64 bytes total)")
-    
-    with open(bin_filename, "r+b") as f:
-        # Update image_size field (unless sign_only mode)
-        if not sign_only:
-            f.seek(4)  # Seek to beginning of "uint32_t image_size"
-            f.write(image_hdr_data_size)
-            print("  Image size field updated")
-        
-        # Update entrypoint field if provided (unless sign_only mode)
-        if not sign_only and entrypoint is not None:
-            f.seek(8)  # Seek to beginning of "uintptr_t image_entrypoint"
-            entrypoint_bytes = struct.pack("<Q", entrypoint)  # 64-bit little-endian
-            f.write(entrypoint_bytes)
-            print("  Entry point field updated")
-        
-        # Update signature field if signature was generated
-        if signature:
-            f.seek(24)  # Seek to beginning of signature field (offset 24)
-            f.write(signature)
-            print("  Signature field updated in binary")
+            # Generate signature for the image data if private key is provided
+            signature = None
+            if private_key_file:
+                print(f"Generating signature using private key: {private_key_file}")
+                # Hash the mapped payload in place; hashlib reads the buffer
+                # directly so no Python-level copy of the payload is made
+                with memoryview(mm)[IMAGE_HDR_SIZE_BYTES:] as data:
+                    digest = hashlib.sha256(data).digest()
+                signature = generate_signature_for_digest(digest, private_key_file)
+                if signature:
+                    print(f"Signature generated successfully (64 bytes)")
+                else:
+                    print("Warning: Failed to generate signature, signature field will remain unchanged")
+
+            print(f"Patching binary '{bin_filename}':")
+            print(f"  Data size: {data_size} bytes")
+            if entrypoint is not None:
+                print(f"  Entry point: 0x{entrypoint:016x}")
+            if signature:
+                print(f"  Signature: {signature[:8].hex()}... (64 bytes total)")
+
+            # Patch a copy of the header and store it back with a single write
+            orig_hdr = mm[:IMAGE_HDR_SIZE_BYTES]
+            image_hdr = bytearray(orig_hdr)
+
+            # Update image_size field (unless sign_only mode)
+            if not sign_only:
+                struct.pack_into("<L", image_hdr, 4, data_size)  # "uint32_t image_size"
+                print("  Image size field updated")
+
+            # Update entrypoint field if provided (unless sign_only mode)
+            if not sign_only and entrypoint is not None:
+                struct.pack_into("<Q", image_hdr, 8, entrypoint)  # "uintptr_t image_entrypoint", 64-bit little-endian
+                print("  Entry point field updated")
+
+            # Update signature field if signature was generated
+            if signature:
+                image_hdr[24:88] = signature  # Signature field (offset 24)
+                print("  Signature field updated in binary")
+
+            # Leave the file untouched if no field actually changed
+            if image_hdr != orig_hdr:
+                mm[:IMAGE_HDR_SIZE_BYTES] = image_hdr
+                mm.flush()
 
 
 def add_image_header(bin_filename, output_filename=None, entrypoint=0, git_sha="", private_key_file=None):
@@ -134,45 +270,62 @@ def add_image_header(bin_filename, output_filename=None, entrypoint=0, git_sha="
     IMAGE_HDR_MAGIC = 0x9ca3
     IMAGE_HDR_VERSION = 1
     
-    # Read the original binary data
-    with open(bin_filename, "rb") as f:
-        data = f.read()
-    
-    data_size = len(data)
-    
-    # Prepare git_sha (truncate to max 7 chars to ensure null termination)
-    git_sha_bytes = git_sha.encode('ascii')[:7]  # Max 7 chars to leave room for null terminator
-    git_sha_bytes = git_sha_bytes.ljust(8, b'\x00')  # Pad to 8 bytes with null bytes
-    
-    # Generate signature for the data if private key is provided
-    signature = b'\x00' * 64  # Default to zeros
-    if private_key_file:
-        print(f"Generating signature using private key: {private_key_file}")
-        signature = generate_signature_for_data(data, private_key_file)
-        if signature:
-            print(f"Signature generated successfully (64 bytes)")
-        else:
-            print("Warning: Failed to generate signature, using zero signature")
-            signature = b'\x00' * 64
-    
-    # Build the image header
-    header = struct.pack("<HHLQ", IMAGE_HDR_MAGIC, IMAGE_HDR_VERSION, data_size, entrypoint)
-    header += git_sha_bytes
-    header += signature
-    
-    # Pad header to ensure it's exactly 96 bytes
-    if len(header) < IMAGE_HDR_SIZE_BYTES:
-        header += b'\x00' * (IMAGE_HDR_SIZE_BYTES - len(header))
-    
     # Determine output filename
     if output_filename is None:
         base, ext = os.path.splitext(bin_filename)
         output_filename = base + ".img"
     
-    # Write the new image file with header + data
-    with open(output_filename, "wb") as f:
-        f.write(header)
-        f.write(data)
+    # Writing in place would truncate the input before it is copied, so go
+    # through a temporary file in that case
+    in_place = os.path.exists(output_filename) and os.path.samefile(bin_filename, output_filename)
+    
+    with open(bin_filename, "rb") as src:
+        data_size = os.fstat(src.fileno()).st_size
+        
+        # Prepare git_sha (truncate to max 7 chars to ensure null termination)
+        git_sha_bytes = git_sha.encode('ascii')[:7]  # Max 7 chars to leave room for null terminator
+        git_sha_bytes = git_sha_bytes.ljust(8, b'\x00')  # Pad to 8 bytes with null bytes
+        
+        # Generate signature for the data if private key is provided
+        signature = b'\x00' * 64  # Default to zeros
+        if private_key_file:
+            print(f"Generating signature using private key: {private_key_file}")
+            # Hash through the already open handle so the signed bytes are
+            # the ones copied below
+            signature = generate_signature_for_digest(_hash_fileobj(src), private_key_file)
+            src.seek(0)
+            if signature:
+                print(f"Signature generated successfully (64 bytes)")
+            else:
+                print("Warning: Failed to generate signature, using zero signature")
+                signature = b'\x00' * 64
+        
+        # Build the full 96-byte image header in one go:
+        # magic, version, image_size, entrypoint, git_sha[8], signature[64], pad[8]
+        header = struct.pack("<HHLQ8s64s8s", IMAGE_HDR_MAGIC, IMAGE_HDR_VERSION, data_size, entrypoint,
+                             git_sha_bytes, signature, b'\x00' * 8)
+        assert len(header) == IMAGE_HDR_SIZE_BYTES
+        
+        # Write the new image file with header + data, streaming the payload
+        if in_place:
+            # Imported here so the common (not in-place) path doesn't pay for them
+            import shutil
+            import tempfile
+
+            out = tempfile.NamedTemporaryFile(dir=os.path.dirname(output_filename) or ".", delete=False)
+        else:
+            out = open(output_filename, "wb")
+        try:
+            with out as f:
+                f.write(header)
+                _copy_payload(src, f, data_size)
+            if in_place:
+                shutil.copymode(bin_filename, out.name)
+                os.replace(out.name, output_filename)
+        except BaseException:
+            if in_place:
+                os.unlink(out.name)
+            raise
     
     print(f"Image header added successfully:")
     print(f"  Input file: {bin_filename}")
@@ -240,17 +393,13 @@ def display_image_header(bin_filename):
         print(f"Entry Point:    0x{image_entrypoint:016x}")
         
         # Convert binary git_sha to string, stopping at null terminator if present
-        git_sha_str = ""
-        for b in git_sha:
-            if b == 0:
-                break
-            git_sha_str += chr(b)
+        git_sha_str = git_sha.split(b'\x00', 1)[0].decode('ascii', 'replace')
             
         print(f"Git SHA:        {git_sha_str}")
         
         # Display signature info (first 8 bytes for brevity)
         sig_preview = signature[:8] if len(signature) >= 8 else signature
-        sig_hex = ' '.join(f'{b:02x}' for b in sig_preview)
+        sig_hex = binascii.hexlify(sig_preview, ' ').decode()
         print(f"Signature:      {sig_hex}... (64 bytes total)")
         print(f"Total File Size: {len(image_hdr) + len(data)} bytes")
     